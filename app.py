@@ -1,14 +1,8 @@
-from llm_client import OllamaClient
-from console_utils import console
-from prompts import *
-from rich.panel import Panel
-from rich.box import ROUNDED
-from rich.text import Text
-from rich.live import Live
-from rich import print as rprint
-from rich.markup import escape
+# Rich and the Ollama client are imported where they are used rather than here,
+# so that --help and argument errors don't pay for loading them
 import argparse
 import sys
+import threading
 import time
 
 # MODEL_A_NAME = "deepseek-r1:latest"
@@ -25,6 +19,74 @@ CLIENT_B_STYLE = "bold green"
 CLIENT_B_PANEL_STYLE = "green"
 
 
+def _stream_turn(client, title, panel_kwargs, max_tokens, stats, refresh_per_second):
+    """
+    Stream one response from a client into a live-updating panel.
+
+    :param client: The OllamaClient instance whose turn it is
+    :param title: Panel title markup for the client
+    :param panel_kwargs: Styling keyword arguments for the client's panel
+    :param max_tokens: Maximum tokens for the response
+    :param stats: Show message history statistics in the panel title
+    :param refresh_per_second: How often the live display redraws
+    :return: A tuple of the response text and the response time in seconds
+    """
+    from console_utils import console
+    from llm_client import CHARS_PER_TOKEN
+    from rich.live import Live
+    from rich.panel import Panel
+    from rich.text import Text
+
+    start_time = time.perf_counter()
+
+    # The history only changes once the response has finished streaming,
+    # so the title shown while streaming can be built once up front
+    streaming_title = title
+    if stats:
+        msg_count = len(client.message_history)
+        streaming_title += f" [dim]({msg_count} msgs)[/dim]"
+
+    # Build the panel once and let streamed chunks append to its text in place.
+    # The live display redraws it from its own refresh thread at most
+    # refresh_per_second times, regardless of how fast tokens arrive.
+    response_text = Text(no_wrap=False)
+    panel = Panel(response_text, title=streaming_title, **panel_kwargs)
+
+    # Create a live display that will update as text streams in
+    with Live(panel, console=console, refresh_per_second=refresh_per_second):
+        # Generate a response using chat API with full conversation history
+        response = client.chat_stream_with_callback(
+            max_tokens,
+            callback=response_text.append,
+        )
+
+        # Calculate response time
+        end_time = time.perf_counter()
+        response_time = end_time - start_time
+
+        # Switch to the final title with timing info, the live display
+        # renders it one last time when the block exits
+        if stats:
+            msg_count = len(client.message_history)
+            panel.title = f"{title} [dim]({msg_count} msgs, {response_time:.1f}s)[/dim]"
+        else:
+            panel.title = title
+
+    # Trim history to prevent it from growing too large. Check the history as it will be
+    # once the other model's reply is added, assuming that reply is about as long as this
+    # one, so the summary is generated in the background while the other model takes its
+    # turn. Otherwise the trim would run synchronously before this client's next reply
+    incoming_tokens = len(response) // CHARS_PER_TOKEN
+    if client.needs_trim(client.history_limit - 1, incoming_tokens):
+        client.trim_message_history_in_background(
+            max_messages=client.history_limit - 1,
+            keep_system_prompt=True,
+            incoming_tokens=incoming_tokens,
+        )
+
+    return response, response_time
+
+
 def simulate_conversation(
     client_a,
     client_b,
@@ -32,8 +94,11 @@ def simulate_conversation(
     max_tokens,
     initial_prompt="",
     debug_mode=False,
-    delay=0.00,  # Delay between streaming chunks
+    delay=0.00,  # Delay between display updates while streaming
     stats=False,  # Show statistics in panel titles
+    step=False,  # Wait for Enter after each turn
+    output_file_handle=None,  # Open file the transcript is written to as it happens
+    collect_in_memory=False,  # Also keep the transcript in memory and return it
 ):
     """
     Simulate a conversation between two LLM clients with rich formatting.
@@ -43,33 +108,50 @@ def simulate_conversation(
     :param initial_prompt: Optional initial prompt to start the conversation
     :param max_turns: Maximum number of conversation turns
     :param max_tokens: Maximum tokens per response
-    :param delay: Delay between streaming chunks
+    :param delay: Delay between display updates while streaming
     :param stats: Show message history statistics in panel titles
-    :return: The complete conversation history as a string
+    :param step: Wait for the user to press Enter after each turn
+    :param output_file_handle: Open file to append each message to as soon as it completes
+    :param collect_in_memory: Also collect the conversation in memory so it can be returned
+    :return: The complete conversation history as a string if collect_in_memory is set, otherwise None
     """
-    conversation_history = []
+    from console_utils import console
+    from rich.box import ROUNDED
+    from rich.markup import escape
+    from rich.panel import Panel
+    from rich.text import Text
+
+    conversation_history = [] if collect_in_memory else None
+
+    def record_message(message):
+        # Write each message out as soon as it completes so nothing is lost on a crash
+        if output_file_handle:
+            output_file_handle.write(f"{message}\n\n")
+            output_file_handle.flush()
+        if conversation_history is not None:
+            conversation_history.append(message)
 
     if debug_mode:
         console.print(
             f"[bold yellow]Debug mode enabled![/bold yellow] Max turns: {max_turns}, Max tokens: {max_tokens}, History limit: {client_a.history_limit}"
         )
         console.print(
-            f"[bold yellow]Model A:[/bold yellow] {client_a.model_name}, [bold yellow]Model B:[/bold yellow] {client_b.model_name}"
+            f"[bold yellow]Model A:[/bold yellow] {escape(client_a.model_name)}, [bold yellow]Model B:[/bold yellow] {escape(client_b.model_name)}"
         )
         console.print(
-            f"[bold yellow]Initial prompt:[/bold yellow] {initial_prompt if initial_prompt else 'None'}"
+            f"[bold yellow]Initial prompt:[/bold yellow] {escape(initial_prompt) if initial_prompt else 'None'}"
         )
         console.print(
-            f"[bold yellow]Model A Prompt:[/bold yellow] {client_a.system_prompt}"
+            f"[bold yellow]Model A Prompt:[/bold yellow] {escape(str(client_a.system_prompt))}"
         )
         console.print(
-            f"[bold yellow]Model B Prompt:[/bold yellow] {client_b.system_prompt}"
+            f"[bold yellow]Model B Prompt:[/bold yellow] {escape(str(client_b.system_prompt))}"
         )
 
     # Display a title for the conversation
     console.print(
         Panel.fit(
-            f"[bold yellow]AI Conversation Beginning![/bold yellow] 🤖\nWatch as [bold]{escape(args.model_a)}[/bold] and [bold]{escape(args.model_b)}[/bold] have a conversation.",
+            f"[bold yellow]AI Conversation Beginning![/bold yellow] 🤖\nWatch as [bold]{escape(client_a.model_name)}[/bold] and [bold]{escape(client_b.model_name)}[/bold] have a conversation.",
             box=ROUNDED,
             border_style="yellow",
             padding=(1, 2),
@@ -80,7 +162,7 @@ def simulate_conversation(
         # Display the initial prompt
         console.print(
             Panel(
-                f"[italic]{initial_prompt}[/italic]",
+                f"[italic]{escape(initial_prompt)}[/italic]",
                 title="[bold]Initial Prompt[/bold]",
                 title_align="left",
                 border_style="yellow",
@@ -88,211 +170,111 @@ def simulate_conversation(
                 padding=(1, 2),
             )
         )
-        conversation_history.append(f"Initial: {initial_prompt}")
+        record_message(f"Initial: {initial_prompt}")
 
         # Add initial prompt to client B's history (client A will generate first response)
         client_b.add_message_to_history("user", initial_prompt)
 
+    # The delay paces how often the live display redraws, never how fast tokens are read
+    refresh_per_second = 1 / max(1 / 20, delay)
+
+    # Only worth preloading the peer model if the two clients use different models
+    preload_peer = client_a.model_name != client_b.model_name
+
+    # Panel titles, styling and the "thinking" lines never change during the conversation,
+    # so build them once
+    title_a = f"[{CLIENT_A_STYLE}]{escape(client_a.model_name)}[/{CLIENT_A_STYLE}]"
+    title_b = f"[{CLIENT_B_STYLE}]{escape(client_b.model_name)}[/{CLIENT_B_STYLE}]"
+    panel_kwargs_a = dict(
+        title_align="left",
+        border_style=CLIENT_A_PANEL_STYLE,
+        box=ROUNDED,
+        padding=(1, 2),
+    )
+    panel_kwargs_b = dict(
+        title_align="left",
+        border_style=CLIENT_B_PANEL_STYLE,
+        box=ROUNDED,
+        padding=(1, 2),
+    )
+    thinking_a = Text.from_markup(
+        f"\n[{CLIENT_A_STYLE}]🤖 {escape(client_a.model_name)} is thinking...[/{CLIENT_A_STYLE}]"
+    )
+    thinking_b = Text.from_markup(
+        f"\n[{CLIENT_B_STYLE}]🤖 {escape(client_b.model_name)} is thinking...[/{CLIENT_B_STYLE}]"
+    )
+
     try:
         for turn in range(max_turns):
-            # Add a spacer between turns
-            console.print("")
+            # Using the console as a context manager buffers these prints into a single write
+            with console:
+                # Add a spacer between turns
+                console.print("")
 
-            # Display turn counter
-            console.print(
-                f"[bold white on bright_black]Round {turn+1}/{max_turns}[/bold white on bright_black]",
-                justify="center",
-            )
-
-            # Client A's turn
-            console.print(
-                f"\n[{CLIENT_A_STYLE}]🤖 {client_a.model_name} is thinking...[/{CLIENT_A_STYLE}]"
-            )
-
-            # Create a buffer to collect the streamed text
-            response_buffer = ""
-            start_time = time.time()
-
-            # Create a live display that will update as text streams in
-            with Live(
-                Panel(
-                    "",
-                    title=f"[{CLIENT_A_STYLE}]{client_a.model_name}[/{CLIENT_A_STYLE}]",
-                    title_align="left",
-                    border_style=CLIENT_A_PANEL_STYLE,
-                    box=ROUNDED,
-                    padding=(1, 2),
-                ),
-                console=console,
-                refresh_per_second=20,
-            ) as live:
-                # Define a callback function that updates the live display
-                def display_chunk(chunk):
-                    nonlocal response_buffer
-                    response_buffer += chunk
-
-                    # Generate title with optional stats
-                    title = (
-                        f"[{CLIENT_A_STYLE}]{client_a.model_name}[/{CLIENT_A_STYLE}]"
-                    )
-                    if stats:
-                        msg_count = len(client_a.message_history)
-                        title += f" [dim]({msg_count} msgs)[/dim]"
-
-                    live.update(
-                        Panel(
-                            Text(response_buffer, no_wrap=False),
-                            title=title,
-                            title_align="left",
-                            border_style=CLIENT_A_PANEL_STYLE,
-                            box=ROUNDED,
-                            padding=(1, 2),
-                        )
-                    )
-                    time.sleep(delay)
-
-                # Get response from client A
-                # Add the message from client B (or initial prompt) to client A's history
-                if turn == 0:
-                    # First turn: Use the initial prompt
-                    client_a.add_message_to_history("user", initial_prompt)
-                else:
-                    # Subsequent turns: Use the previous response from client B
-                    client_a.add_message_to_history("user", response_b)
-
-                # Generate a response using chat API with full conversation history
-                response_a = client_a.chat_stream_with_callback(
-                    max_tokens,
-                    callback=display_chunk,
-                )
-
-                # Calculate response time
-                end_time = time.time()
-                response_time = end_time - start_time
-
-                # Update the panel with final response and timing info
-                final_title = (
-                    f"[{CLIENT_A_STYLE}]{client_a.model_name}[/{CLIENT_A_STYLE}]"
-                )
-                if stats:
-                    msg_count = len(client_a.message_history)
-                    final_title += (
-                        f" [dim]({msg_count} msgs, {response_time:.1f}s)[/dim]"
-                    )
-
-                live.update(
-                    Panel(
-                        Text(response_buffer, no_wrap=False),
-                        title=final_title,
-                        title_align="left",
-                        border_style=CLIENT_A_PANEL_STYLE,
-                        box=ROUNDED,
-                        padding=(1, 2),
-                    )
+                # Display turn counter
+                console.print(
+                    f"[bold white on bright_black]Round {turn+1}/{max_turns}[/bold white on bright_black]",
+                    justify="center",
                 )
 
-                # Trim history to prevent it from growing too large
-                client_a.trim_message_history(
-                    max_messages=client_a.history_limit, keep_system_prompt=True
-                )
+                # Client A's turn
+                console.print(thinking_a)
+
+            # Load model B in the background while model A is streaming
+            if preload_peer:
+                threading.Thread(target=client_b.preload, daemon=True).start()
+
+            # Add the message from client B (or initial prompt) to client A's history
+            if turn == 0:
+                # First turn: Use the initial prompt
+                client_a.add_message_to_history("user", initial_prompt)
+            else:
+                # Subsequent turns: Use the previous response from client B
+                client_a.add_message_to_history("user", response_b)
+
+            # Get response from client A
+            response_a, _ = _stream_turn(
+                client_a,
+                title_a,
+                panel_kwargs_a,
+                max_tokens,
+                stats,
+                refresh_per_second,
+            )
 
             # Add the response to conversation history
-            conversation_history.append(f"{client_a.model_name}: {response_a}")
-
-            # Add a spacer before the next response
-            console.print("")
-
-            # Client B's turn
-            console.print(
-                f"\n[{CLIENT_B_STYLE}]🤖 {client_b.model_name} is thinking...[/{CLIENT_B_STYLE}]"
+            record_message(f"{client_a.model_name}: {response_a}")
+
+            with console:
+                # Add a spacer before the next response
+                console.print("")
+
+                # Client B's turn
+                console.print(thinking_b)
+
+            # Load model A in the background while model B is streaming
+            if preload_peer:
+                threading.Thread(target=client_a.preload, daemon=True).start()
+
+            # Add client A's response to client B's history
+            client_b.add_message_to_history("user", response_a)
+
+            # Get response from client B
+            response_b, _ = _stream_turn(
+                client_b,
+                title_b,
+                panel_kwargs_b,
+                max_tokens,
+                stats,
+                refresh_per_second,
             )
 
-            # Reset the buffer for client B
-            response_buffer = ""
-            start_time = time.time()
-
-            # Create a live display for client B
-            with Live(
-                Panel(
-                    "",
-                    title=f"[{CLIENT_B_STYLE}]{client_b.model_name}[/{CLIENT_B_STYLE}]",
-                    title_align="left",
-                    border_style=CLIENT_B_PANEL_STYLE,
-                    box=ROUNDED,
-                    padding=(1, 2),
-                ),
-                console=console,
-                refresh_per_second=20,
-            ) as live:
-                # Define a callback function that updates the live display
-                def display_chunk(chunk):
-                    nonlocal response_buffer
-                    response_buffer += chunk
-
-                    # Generate title with optional stats
-                    title = (
-                        f"[{CLIENT_B_STYLE}]{client_b.model_name}[/{CLIENT_B_STYLE}]"
-                    )
-                    if stats:
-                        msg_count = len(client_b.message_history)
-                        title += f" [dim]({msg_count} msgs)[/dim]"
-
-                    live.update(
-                        Panel(
-                            Text(response_buffer, no_wrap=False),
-                            title=title,
-                            title_align="left",
-                            border_style=CLIENT_B_PANEL_STYLE,
-                            box=ROUNDED,
-                            padding=(1, 2),
-                        )
-                    )
-                    time.sleep(delay)
-
-                # Get response from client B
-                # Add client A's response to client B's history
-                client_b.add_message_to_history("user", response_a)
-
-                # Generate a response using chat API with full conversation history
-                response_b = client_b.chat_stream_with_callback(
-                    max_tokens,
-                    callback=display_chunk,
-                )
-
-                # Calculate response time
-                end_time = time.time()
-                response_time = end_time - start_time
-
-                # Update the panel with final response and timing info
-                final_title = (
-                    f"[{CLIENT_B_STYLE}]{client_b.model_name}[/{CLIENT_B_STYLE}]"
-                )
-                if stats:
-                    msg_count = len(client_b.message_history)
-                    final_title += (
-                        f" [dim]({msg_count} msgs, {response_time:.1f}s)[/dim]"
-                    )
-
-                live.update(
-                    Panel(
-                        Text(response_buffer, no_wrap=False),
-                        title=final_title,
-                        title_align="left",
-                        border_style=CLIENT_B_PANEL_STYLE,
-                        box=ROUNDED,
-                        padding=(1, 2),
-                    )
-                )
-
-                # Trim history to prevent it from growing too large
-                client_b.trim_message_history(
-                    max_messages=client_b.history_limit, keep_system_prompt=True
-                )
             # Add the response to conversation history
-            conversation_history.append(f"{client_b.model_name}: {response_b}")
+            record_message(f"{client_b.model_name}: {response_b}")
 
-            # If debug mode is enabled, prompt the user to continue or stop after each turn
-            if debug_mode:
+            # If stepping is enabled, prompt the user to continue or stop after each turn.
+            # Background trims and preloads are threads, so they keep running while this waits
+            if step:
                 console.print(
                     "[bold yellow]Press Enter to continue to the next turn, or Ctrl+C to stop...[/bold yellow]"
                 )
@@ -308,7 +290,9 @@ def simulate_conversation(
             )
         )
     except KeyboardInterrupt:
-        # Handle Ctrl+C gracefully
+        # Handle Ctrl+C gracefully, making sure the partial history is on disk first
+        if output_file_handle:
+            output_file_handle.flush()
         console.print("\n")
         console.print(
             Panel(
@@ -320,11 +304,18 @@ def simulate_conversation(
         )
         console.print("[italic]Saving partial conversation history...[/italic]")
     except Exception as e:
-        # Handle other exceptions
+        # Handle other exceptions, making sure the partial history is on disk first.
+        # The error itself may have come from writing the file, so don't let a
+        # failing flush hide it.
+        if output_file_handle:
+            try:
+                output_file_handle.flush()
+            except OSError:
+                pass
         console.print("\n")
         console.print(
             Panel(
-                f"[bold red]Error during conversation:[/bold red]\n{str(e)}",
+                f"[bold red]Error during conversation:[/bold red]\n{escape(str(e))}",
                 border_style="red",
                 box=ROUNDED,
                 padding=(1, 1),
@@ -335,7 +326,9 @@ def simulate_conversation(
         )
 
     # Return the conversation history regardless of how we exited the loop
-    return "\n\n".join(conversation_history)
+    if conversation_history is not None:
+        return "\n\n".join(conversation_history)
+    return None
 
 
 if __name__ == "__main__":
@@ -361,6 +354,11 @@ if __name__ == "__main__":
         action="store_true",
         help="Enable debug mode for additional output",
     )
+    parser.add_argument(
+        "--step",
+        action="store_true",
+        help="Wait for Enter after each turn (on by default with --debug in an interactive terminal)",
+    )
     parser.add_argument(
         "--show_json",
         action="store_true",
@@ -369,7 +367,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "--log_history",
         action="store_true",
-        help="Log message_history state to a file (for debugging)",
+        help="Append each message and trim to message_history.log as JSON lines (for debugging)",
     )
     parser.add_argument(
         "--history_limit",
@@ -377,11 +375,35 @@ if __name__ == "__main__":
         default=100,
         help="Number of messages to keep in conversation history for each model before summarizing and trimming. Turn this down if messages gradually start to take longer to generate.",
     )
+    parser.add_argument(
+        "--context_limit",
+        type=int,
+        default=0,
+        help="Approximate number of tokens of conversation history to keep for each model before summarizing and trimming. The most recent exchanges that fit in half of this are kept as-is. 0 disables the token limit and only --history_limit applies.",
+    )
+    parser.add_argument(
+        "--summary_mode",
+        choices=["simple", "llm"],
+        default="simple",
+        help="How trimmed history is summarized: 'simple' builds a bullet list of the trimmed messages locally, 'llm' asks the model to write the summary (slower, but keeps more context)",
+    )
+    parser.add_argument(
+        "--cache_threshold",
+        type=float,
+        default=0.0,
+        help="Reuse a model's earlier reply when the message it is replying to has at least this cosine similarity (e.g. 0.9) to one it has already answered. 0 disables the cache.",
+    )
+    parser.add_argument(
+        "--embed_model",
+        type=str,
+        default="all-minilm:latest",
+        help="Name of the embedding model used by --cache_threshold",
+    )
     parser.add_argument(
         "--delay",
         type=float,
         default=0.00,
-        help="Delay in seconds between streaming chunks (default: 0.00 for faster streaming)",
+        help="Delay in seconds between display updates while streaming (default: 0.00 for the fastest refresh rate). Does not slow down token generation.",
     )
     parser.add_argument(
         "--model_a",
@@ -420,9 +442,17 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
+    from console_utils import console
+    from llm_client import OllamaClient
+    from ollama_utils import close_session
+    from prompts import DEBATE_PROMPT, INITIAL_PROMPT, MODEL_A_PROMPT, MODEL_B_PROMPT
+    from rich.box import ROUNDED
+    from rich.markup import escape
+    from rich.panel import Panel
+
     if args.debate_topic:
         console.print(
-            f"[bold yellow]Debate mode enabled! Topic: {args.debate_topic}[/bold yellow]"
+            f"[bold yellow]Debate mode enabled! Topic: {escape(args.debate_topic)}[/bold yellow]"
         )
         # If a debate topic is provided, override the system prompts
         MODEL_A_PROMPT = DEBATE_PROMPT.format(
@@ -449,6 +479,10 @@ if __name__ == "__main__":
         system_prompt=MODEL_A_PROMPT,
         history_limit=args.history_limit,
         log_history=args.log_history,
+        context_limit=args.context_limit,
+        cache_threshold=args.cache_threshold,
+        embed_model=args.embed_model,
+        summary_mode=args.summary_mode,
     )
     client_B = OllamaClient(
         model_name=args.model_b,
@@ -457,6 +491,10 @@ if __name__ == "__main__":
         system_prompt=MODEL_B_PROMPT,
         history_limit=args.history_limit,
         log_history=args.log_history,
+        context_limit=args.context_limit,
+        cache_threshold=args.cache_threshold,
+        embed_model=args.embed_model,
+        summary_mode=args.summary_mode,
     )
 
     # Print welcome message
@@ -467,22 +505,23 @@ if __name__ == "__main__":
     console.print("")
 
     try:
-        # Example of a simulated conversation between the two models
-        conversation_history = simulate_conversation(
-            client_A,
-            client_B,
-            max_turns=args.max_turns,
-            max_tokens=args.max_tokens + 50,
-            initial_prompt=INITIAL_PROMPT,
-            debug_mode=args.debug,
-            delay=args.delay,
-            stats=args.stats,
-        )
-
-        # Save the conversation history to a file
+        # The conversation history is written to this file as the conversation happens
         output_file = "conversation_history.txt"
-        with open(output_file, "w") as f:
-            f.write(conversation_history)
+        with open(output_file, "w", buffering=1) as f:
+            # Example of a simulated conversation between the two models
+            simulate_conversation(
+                client_A,
+                client_B,
+                max_turns=args.max_turns,
+                max_tokens=args.max_tokens + 50,
+                initial_prompt=INITIAL_PROMPT,
+                debug_mode=args.debug,
+                delay=args.delay,
+                stats=args.stats,
+                # Never wait for input when stdin is not a terminal, e.g. in scripted runs
+                step=args.step or (args.debug and sys.stdin.isatty()),
+                output_file_handle=f,
+            )
 
         # Confirm save with nice formatting
         console.print("")
@@ -500,3 +539,8 @@ if __name__ == "__main__":
         # The function already handles it, but this is a fallback
         console.print("\n[bold red]Application interrupted by user![/bold red]")
         sys.exit(0)
+    finally:
+        # Release the pooled connections to Ollama
+        client_A.close()
+        client_B.close()
+        close_session()
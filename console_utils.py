@@ -4,5 +4,7 @@ Shared console instance for consistent Rich formatting across the application.
 
 from rich.console import Console
 
-# Create a single console instance that can be imported by other modules
-console = Console()
+# Create a single console instance that can be imported by other modules.
+# All styling is explicit markup, so skip the automatic highlighting and emoji code
+# substitution Rich would otherwise run over every printed string
+console = Console(highlight=False, emoji=False)
@@ -1,20 +1,30 @@
 import requests
+import hashlib
 import json
-import platform
-import subprocess
+import threading
 import sys
+from collections import OrderedDict
 from console_utils import console
+from rich.markup import escape
 from rich.panel import Panel
+from semantic_cache import SemanticCache
 from ollama_utils import (
-    provide_ollama_installation_guide,
-    provide_model_pull_guide,
     strip_think_tag,
     check_model_availability,
     check_ollama_availability,
-    try_start_ollama_service,
 )
 
 HISTORY_LOG_FILE = "message_history.log"
+# Rough average used to estimate token counts without loading a model tokenizer
+CHARS_PER_TOKEN = 4
+# Start of the message that replaces trimmed history with its summary
+SUMMARY_PREFIX = "Summary of conversation so far: "
+
+# Replies to identical non-streaming chat requests, shared by all clients.
+# Kept in least recently used order so the oldest entry is dropped first when full
+RESPONSE_CACHE_SIZE = 256
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
 
 
 class OllamaClient:
@@ -27,6 +37,11 @@ class OllamaClient:
         quiet_mode: bool = False,
         history_limit: int = 30,
         log_history: bool = False,
+        context_limit: int = 0,
+        cache_threshold: float = 0.0,
+        embed_model: str = "all-minilm:latest",
+        cache_enabled: bool = True,
+        summary_mode: str = "simple",
     ):
         self.quiet_mode = quiet_mode
         self.debug_mode = debug_mode
@@ -34,28 +49,66 @@ class OllamaClient:
         self.model_name = model_name
         self.system_prompt = system_prompt
         self.history_limit = history_limit
+        # Approximate token budget for the message history, 0 means no limit
+        self.context_limit = context_limit
+        # Reuse the reply to an identical earlier request in chat()
+        self.cache_enabled = cache_enabled
+        # How trimmed history is summarized: "simple" builds a bullet list locally,
+        # "llm" asks the model for a summary (better context, but a full generation)
+        self.summary_mode = summary_mode
         self.log_history = log_history
         self.base_url = "http://localhost:11434/api"
         self.message_history = (
             []
         )  # Initialize an empty message history, used for chat models
         self.trim_count = 0  # Counter for how many times we've trimmed the history
+        # Reuse one keep-alive connection pool for every request to Ollama,
+        # including the availability checks below
+        self.session = requests.Session()
+        # Guards message_history while a trim runs in a background thread
+        self._history_lock = threading.Lock()
+        self._trim_thread = None
+        # Client used to summarize trimmed history, created on the first LLM summary
+        self._summarizer = None
+
+        # Messages are appended to the log one JSON object per line as they are added,
+        # so logging costs the same on every turn however long the history gets
+        self._history_log = None
+        if self.log_history:
+            self._history_log = open(HISTORY_LOG_FILE, "a", buffering=1)
 
         # Add system prompt to message history if provided
         if self.system_prompt:
             self.message_history.append(
                 {"role": "system", "content": self.system_prompt}
             )
+            self._log_history_entry(self.message_history[-1])
 
         # Check if Ollama is installed and running
-        check_ollama_availability(self.base_url, self.quiet_mode)
+        check_ollama_availability(self.base_url, self.quiet_mode, self.session)
 
         # Check if the requested model is available
-        check_model_availability(self.model_name, self.base_url, self.quiet_mode)
+        check_model_availability(
+            self.model_name, self.base_url, self.quiet_mode, self.session
+        )
+
+        # Optionally reuse replies to messages similar to ones already answered
+        self.semantic_cache = None
+        if cache_threshold > 0:
+            check_model_availability(
+                embed_model, self.base_url, self.quiet_mode, self.session
+            )
+            self.semantic_cache = SemanticCache(
+                embed_model,
+                cache_threshold,
+                base_url=self.base_url,
+                session=self.session,
+                debug_mode=self.debug_mode,
+            )
 
         if not self.quiet_mode:
             console.print(
-                f"[bold green]OllamaClient initialized with model: {self.model_name}[/bold green]"
+                f"[bold green]OllamaClient initialized with model: {escape(self.model_name)}[/bold green]"
             )
 
     def add_message_to_history(self, role: str, content: str):
@@ -64,16 +117,52 @@ class OllamaClient:
         :param role: The role of the message sender ('user' or 'assistant').
         :param content: The content of the message.
         """
-        self.message_history.append({"role": role, "content": content})
+        with self._history_lock:
+            self.message_history.append({"role": role, "content": content})
+            self._log_history_entry(self.message_history[-1])
         # print(f"✅ Added message to history: {role} - {content}")
-        if self.log_history:
-            with open(HISTORY_LOG_FILE, "w") as f:
-                f.write(f"Message History Size: {len(self.message_history)}\n")
-                f.write(
-                    f"Message History in Bytes: {self._calculate_message_history_size()}\n"
-                )
-                f.write(f"Model Name: {self.model_name}\n")
-                f.write(json.dumps(self.message_history, indent=2))
+
+    def _log_history_entry(self, entry: dict):
+        """
+        Append an entry to the message history log as a single line of JSON.
+        Does nothing unless history logging is enabled.
+
+        :param entry: The message, or trim event, to log.
+        """
+        if self._history_log is not None:
+            self._history_log.write(
+                json.dumps({"model": self.model_name, **entry}) + "\n"
+            )
+
+    def preload(self):
+        """
+        Ask Ollama to load the model into memory and process the current message history,
+        so the next chat request only has to process the message added after it.
+        Intended to be run in a background thread while the other model is streaming,
+        so that the model load and prompt processing overlap with the other model's turn.
+        """
+        # Process the history as it will be once any background trim has finished
+        trim_thread = self._trim_thread
+        if trim_thread is not None:
+            trim_thread.join()
+        with self._history_lock:
+            messages = list(self.message_history)
+
+        payload = {"model": self.model_name, "messages": messages, "stream": False}
+        if messages:
+            # Generate a single token, Ollama keeps the processed prompt in its cache
+            # and reuses it for the next request that starts with the same messages
+            payload["options"] = {"num_predict": 1}
+
+        try:
+            self.session.post(
+                f"{self.base_url}/chat",
+                json=payload,
+                timeout=120,
+            )
+        except requests.RequestException as e:
+            if self.debug_mode:
+                print(f"Error preloading model {self.model_name}: {e}")
 
     def chat(self, max_tokens: int = 1_000) -> str:
         """
@@ -87,7 +176,8 @@ class OllamaClient:
                 "Message history is empty. Add messages before calling chat()."
             )
 
-        # Auto-trim if the history is getting too long
+        # Let any background trim finish, then auto-trim if the history is getting too long
+        self.wait_for_trim()
         self._auto_trim_if_needed()
 
         # Build the request payload
@@ -101,17 +191,38 @@ class OllamaClient:
         if self.show_json:
             print(f"\n****\nPayload for chat: {json.dumps(payload, indent=2)} \n****")
 
-        response = requests.post(
-            f"{self.base_url}/chat",
-            json=payload,
-        )
+        cache_key = None
+        chat_response = None
+        if self.cache_enabled:
+            cache_key = hashlib.sha256(
+                json.dumps(payload, sort_keys=True).encode()
+            ).hexdigest()
+            with _response_cache_lock:
+                chat_response = _response_cache.get(cache_key)
+                if chat_response is not None:
+                    _response_cache.move_to_end(cache_key)
+
+        if chat_response is None:
+            response = self.session.post(
+                f"{self.base_url}/chat",
+                json=payload,
+            )
+
+            response.raise_for_status()
+            data = response.json()
+            chat_response = data.get("message", {}).get("content", "")
 
-        response.raise_for_status()
-        data = response.json()
-        chat_response = data.get("message", {}).get("content", "")
+            if cache_key is not None:
+                with _response_cache_lock:
+                    _response_cache[cache_key] = chat_response
+                    if len(_response_cache) > RESPONSE_CACHE_SIZE:
+                        _response_cache.popitem(last=False)
+        elif self.debug_mode:
+            print("Using cached chat response")
 
         # Add the assistant's response to the message history
         self.message_history.append({"role": "assistant", "content": chat_response})
+        self._log_history_entry(self.message_history[-1])
 
         if self.debug_mode:
             print(f"Chat response: {chat_response}")
@@ -130,9 +241,25 @@ class OllamaClient:
                 "Message history is empty. Add messages before calling chat_stream()."
             )
 
-        # Auto-trim if the history is getting too long
+        # Let any background trim finish, then auto-trim if the history is getting too long
+        self.wait_for_trim()
         self._auto_trim_if_needed()
 
+        # Reuse a cached reply if a similar message has been answered before
+        cache_embedding = None
+        last_message = self.message_history[-1]
+        if self.semantic_cache and last_message.get("role") == "user":
+            cache_embedding = self.semantic_cache.embed(last_message["content"])
+            if cache_embedding is not None:
+                cached_reply = self.semantic_cache.lookup(cache_embedding)
+                if cached_reply is not None:
+                    yield cached_reply
+                    self.message_history.append(
+                        {"role": "assistant", "content": cached_reply}
+                    )
+                    self._log_history_entry(self.message_history[-1])
+                    return
+
         # Build the request payload
         payload = {
             "model": self.model_name,
@@ -146,33 +273,41 @@ class OllamaClient:
                 f"\n****\nPayload for streaming chat: {json.dumps(payload, indent=2)} \n****"
             )
 
-        response = requests.post(
+        response_parts = []
+        # Closing the response hands the connection back to the session's pool
+        with self.session.post(
             f"{self.base_url}/chat",
             json=payload,
             stream=True,
-        )
-        response.raise_for_status()
+        ) as response:
+            response.raise_for_status()
+
+            # Read to the end of the body rather than breaking on the "done" message,
+            # Ollama ends it right after, and a fully read response goes back to the pool
+            for line in response.iter_lines():
+                # The final "done" message has no content, only timing stats, so skip it
+                # without parsing. Quotes inside content are escaped, so text can't match
+                if not line or b'"done":true' in line:
+                    continue
 
-        full_response = ""
-        for line in response.iter_lines():
-            if line:
                 try:
                     data = json.loads(line)
                     message = data.get("message", {})
                     chunk = message.get("content", "")
                     if chunk:
-                        full_response += chunk
+                        response_parts.append(chunk)
                         yield chunk
-
-                    # Check if done
-                    if data.get("done", False):
-                        break
                 except json.JSONDecodeError:
                     print(f"Error decoding JSON: {line}")
                     continue
 
         # After streaming is complete, add the full response to message history
+        full_response = "".join(response_parts)
         self.message_history.append({"role": "assistant", "content": full_response})
+        self._log_history_entry(self.message_history[-1])
+
+        if cache_embedding is not None:
+            self.semantic_cache.store(cache_embedding, full_response)
 
     def chat_stream_with_callback(self, max_tokens: int = 100, callback=None):
         """
@@ -183,78 +318,141 @@ class OllamaClient:
         :param callback: A function to call with each chunk (e.g., to display it).
         :return: The complete generated chat response as a string.
         """
-        result = ""
         for chunk in self.chat_stream(max_tokens):
             # Apply the callback to each chunk if provided
             if callback:
                 callback(chunk)
 
-            # Accumulate the result (not needed since we already add to history in chat_stream)
-            result += chunk
-
+        # chat_stream has already joined the chunks and added them to the history as the
+        # last message, so reuse that instead of accumulating a second copy here.
         # Strip think tags if they exist
-        result = strip_think_tag(result)
+        result = strip_think_tag(self.message_history[-1]["content"])
 
         return result
 
-    def trim_message_history(self, max_messages, keep_system_prompt=True):
+    def trim_message_history_in_background(
+        self, max_messages, keep_system_prompt=True, incoming_tokens=0
+    ):
+        """
+        Run trim_message_history in a background thread, so that summarizing this
+        client's history overlaps with the other model's turn. The next chat request
+        from this client waits for it to finish.
+
+        :param max_messages: Maximum number of messages before triggering trim
+        :param keep_system_prompt: Whether to always keep the system prompt
+        :param incoming_tokens: Estimated tokens of a message not yet added to the history
+        """
+        self.wait_for_trim()
+        self._trim_thread = threading.Thread(
+            target=self.trim_message_history,
+            args=(max_messages, keep_system_prompt, incoming_tokens),
+            daemon=True,
+        )
+        self._trim_thread.start()
+
+    def wait_for_trim(self):
+        """
+        Block until any background trim of the message history has finished.
+        """
+        if self._trim_thread is not None:
+            self._trim_thread.join()
+            self._trim_thread = None
+
+    def trim_message_history(
+        self, max_messages, keep_system_prompt=True, incoming_tokens=0
+    ):
         """
         Trim the message history to prevent it from growing too large.
-        Simple strategy: if history exceeds max_messages, summarize everything
-        (except system prompt) and replace history with just system prompt + summary.
+        Simple strategy: if history exceeds max_messages (or the token budget), summarize
+        everything except the system prompt and any recent exchanges kept within the token
+        budget, and replace history with system prompt + summary + those recent exchanges.
+        Messages added while the summary is being generated are kept after it.
 
         :param max_messages: Maximum number of messages before triggering trim
         :param keep_system_prompt: Whether to always keep the system prompt
+        :param incoming_tokens: Estimated tokens of a message not yet added to the history
+        :return: True if the history was trimmed, False if there was nothing to trim
         """
+        # Check if trimming is needed before doing any other work
+        if not self.needs_trim(max_messages, incoming_tokens):
+            return False
+
         if self.debug_mode:
             print(f"Trimming message history to a maximum of {max_messages} messages.")
             print(f"Current message history length: {len(self.message_history)}")
 
-        # Check if trimming is needed
-        if len(self.message_history) <= max_messages:
-            if self.debug_mode:
-                print("No trimming needed - history is within limit.")
-            return
+        # Work on a snapshot, so messages can keep being added while the
+        # summary is generated in the background
+        with self._history_lock:
+            history = list(self.message_history)
 
         # Identify system prompt if it exists
         system_prompt = None
         start_index = 0
-        if (
-            keep_system_prompt
-            and self.message_history
-            and self.message_history[0].get("role") == "system"
-        ):
-            system_prompt = self.message_history[0]
+        if keep_system_prompt and history and history[0].get("role") == "system":
+            system_prompt = history[0]
             start_index = 1
 
-        # Get all messages to summarize (everything except system prompt)
-        messages_to_summarize = self.message_history[start_index:]
+        # With a token budget, keep the most recent exchanges verbatim as long as they
+        # fit in half of it, walking back from the newest message a user/assistant
+        # pair at a time. Everything older than that (or everything except the
+        # system prompt, without a budget) is summarized.
+        keep_from = len(history)
+        if self.context_limit:
+            budget = self.context_limit // 2
+            min_keep_from = max(start_index, keep_from - max_messages // 2)
+            while keep_from - 2 >= min_keep_from:
+                exchange = history[keep_from - 2 : keep_from]
+                exchange_tokens = self._estimate_tokens(exchange)
+                if exchange_tokens > budget:
+                    break
+                budget -= exchange_tokens
+                keep_from -= 2
+
+        messages_to_summarize = history[start_index:keep_from]
+        recent_messages = history[keep_from:]
 
         if not messages_to_summarize:
             if self.debug_mode:
                 print("No messages to summarize - keeping current history.")
-            return
+            return False
 
         # Create summary of all conversation messages
-        summary = self._create_conversation_summary(messages_to_summarize)
+        if self.summary_mode == "llm":
+            summary = self._create_conversation_summary(messages_to_summarize)
+        else:
+            summary = self._create_simple_summary(messages_to_summarize)
         summary_message = {
             "role": "user",
-            "content": f"Summary of conversation so far: {summary}",
+            "content": f"{SUMMARY_PREFIX}{summary}",
         }
 
-        # Replace message history with just system prompt + summary
+        # Replace message history with system prompt + summary + any recent messages kept
         new_history = []
         if system_prompt:
             new_history.append(system_prompt)
         new_history.append(summary_message)
-
-        self.message_history = new_history
+        new_history.extend(recent_messages)
+
+        # Keep any messages that were added while the summary was being generated
+        with self._history_lock:
+            self.message_history = new_history + self.message_history[len(history) :]
+            self._log_history_entry(
+                {
+                    "event": "trim",
+                    "summarized_messages": len(messages_to_summarize),
+                    "summary": summary,
+                    "history_size": len(self.message_history),
+                    "history_bytes": self._calculate_message_history_size(),
+                }
+            )
 
         if self.debug_mode:
             print(f"Created summary for {len(messages_to_summarize)} messages")
             print(
                 f"Message history after trimming: {len(self.message_history)} messages"
             )
+        return True
 
     def _create_conversation_summary(self, messages):
         """
@@ -269,10 +467,6 @@ class OllamaClient:
         if not messages:
             return "No previous messages."
 
-        # Create a temporary client with the same model for summarization
-        # We don't want to modify the main client's message history
-        summarizer = OllamaClient(self.model_name, quiet_mode=True)
-
         # Prepare the prompt for summarization
         summarization_prompt = {
             "role": "system",
@@ -294,7 +488,7 @@ class OllamaClient:
         }
 
         # Format the conversation as a readable text for the summarizer
-        conversation_text = ""
+        conversation_parts = []
         for msg in messages:
             role = msg.get("role", "unknown")
             content = msg.get("content", "")
@@ -303,14 +497,24 @@ class OllamaClient:
             if role == "system":
                 continue
 
-            conversation_text += f"{role.capitalize()}: {content}\n\n"
-
-        conversation_to_summarize["content"] += conversation_text
+            conversation_parts.append(f"{role.capitalize()}: {content}\n\n")
 
-        # Set up the summarizer's message history
-        summarizer.message_history = [summarization_prompt, conversation_to_summarize]
+        conversation_to_summarize["content"] += "".join(conversation_parts)
 
         try:
+            # Use a separate client with the same model for summarization, so the main
+            # client's message history is untouched. It is kept and reused for later
+            # trims, and is created in here so a failure still falls back below
+            if self._summarizer is None:
+                self._summarizer = OllamaClient(self.model_name, quiet_mode=True)
+            summarizer = self._summarizer
+
+            # Set up the summarizer's message history
+            summarizer.message_history = [
+                summarization_prompt,
+                conversation_to_summarize,
+            ]
+
             # Get the summary from the LLM (with a reasonable token limit)
             summary = summarizer.chat(max_tokens=2000)
             return summary
@@ -324,7 +528,7 @@ class OllamaClient:
     def _create_simple_summary(self, messages):
         """
         Create a concise bullet-point summary of the provided messages.
-        This is used as a fallback if the LLM summarization fails.
+        This is used by default, and as a fallback if the LLM summarization fails.
 
         :param messages: List of message objects to summarize
         :return: A string containing a bullet-point summary
@@ -372,18 +576,75 @@ class OllamaClient:
         if max_messages is None:
             max_messages = self.history_limit
 
-        if len(self.message_history) > max_messages:
-            # Aggressive trimming: reduce to minimal viable history
-            # This will result in: system_prompt + summary + last_exchange (3-4 messages total)
+        # Aggressive trimming: reduce to minimal viable history
+        # This will result in: system_prompt + summary + last_exchange (3-4 messages total)
+        # Only report and count a trim that actually summarized something
+        if self.needs_trim(max_messages) and self.trim_message_history(max_messages):
             console.print(
                 Panel(
-                    "[bold yellow]Trimming Messages[/bold yellow]",
+                    "[bold yellow]Trimmed Messages[/bold yellow]",
                     border_style="yellow",
                 )
             )
-            self.trim_message_history(max_messages)
             self.trim_count += 1
 
+    def needs_trim(self, max_messages=None, incoming_tokens=0):
+        """
+        Check whether the message history has outgrown its message limit or,
+        if one is set, its approximate token budget. The system prompt and the summary
+        from the last trim are left out of the token count, since every trim leaves
+        them (or a new summary) behind and could never bring the count under them.
+
+        :param max_messages: The message count limit. If None, uses self.history_limit
+        :param incoming_tokens: Estimated tokens of a message not yet added to the history
+        :return: True if the history should be trimmed
+        """
+        if max_messages is None:
+            max_messages = self.history_limit
+
+        if len(self.message_history) > max_messages:
+            return True
+
+        if self.context_limit <= 0:
+            return False
+
+        history = self.message_history
+        pinned = 0
+        if history and history[0].get("role") == "system":
+            pinned = 1
+        if len(history) > pinned and history[pinned].get("content", "").startswith(
+            SUMMARY_PREFIX
+        ):
+            pinned += 1
+
+        tokens = self._estimate_tokens(history) - self._estimate_tokens(
+            history[:pinned]
+        )
+        return tokens + incoming_tokens > self.context_limit
+
+    def _estimate_tokens(self, messages):
+        """
+        Estimate the number of tokens in a list of messages from their length.
+
+        :param messages: List of message objects
+        :return: Approximate token count
+        """
+        total_chars = sum(len(message.get("content", "")) for message in messages)
+        return total_chars // CHARS_PER_TOKEN
+
+    def close(self):
+        """
+        Close the HTTP session and release its pooled connections.
+        """
+        # Let a running background trim finish first, as it may still be using the
+        # summarizer, the session or the history log
+        self.wait_for_trim()
+        if self._summarizer is not None:
+            self._summarizer.close()
+        self.session.close()
+        if self._history_log is not None:
+            self._history_log.close()
+
     def _calculate_message_history_size(self):
         """
         Calculate the actual total memory usage of the message history,
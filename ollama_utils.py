@@ -2,48 +2,86 @@
 Utility functions for Ollama installation and model management.
 """
 
-import platform
 import re
 import requests
-import subprocess
 import time
+
+# platform, shutil and subprocess are only needed when Ollama is missing or not
+# running, so they are imported in the functions that handle that
 from console_utils import console
+from rich.markup import escape
+
+# Pattern used by strip_think_tag, compiled once at import
+EXTRA_NEWLINES_PATTERN = re.compile(r"\n{3,}")
+
+# Seconds a fetched model list is reused before asking Ollama again
+TAGS_CACHE_TTL = 30
+_tags_cache = {}  # base_url -> (monotonic fetch time, frozenset of model names)
+
+# Shared keep-alive session for calls that don't pass their own, created on first use
+_session = None
+
+
+def _get_session():
+    """Get the shared session, creating it the first time it is needed."""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
+def close_session():
+    """Close the shared session, if it was ever created, and release its pooled connections."""
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
+
+
+# Installation steps for each platform, keyed by platform.system().lower()
+INSTALL_INSTRUCTIONS = {
+    "darwin": (
+        "To install Ollama on macOS:\n"
+        "1. Download Ollama from https://ollama.com/download\n"
+        "2. Open the downloaded file and follow the installation instructions\n"
+        "3. Start Ollama from your Applications folder\n"
+        "\nAlternatively, install via Homebrew:\n"
+        "   brew install ollama\n"
+        "   ollama serve"
+    ),
+    "linux": (
+        "To install Ollama on Linux:\n"
+        "1. Run the following command:\n"
+        "   curl -fsSL https://ollama.com/install.sh | sh\n"
+        "2. Start the Ollama service:\n"
+        "   ollama serve"
+    ),
+    "windows": (
+        "To install Ollama on Windows:\n"
+        "1. Download Ollama from https://ollama.com/download\n"
+        "2. Run the installer and follow the installation instructions\n"
+        "3. Start Ollama from the Start menu"
+    ),
+}
 
 
 def provide_ollama_installation_guide():
     """Provide platform-specific instructions for installing Ollama."""
-    os_name = platform.system().lower()
+    import platform
 
-    print("\n=== Ollama Installation Guide ===")
-
-    if os_name == "darwin":  # macOS
-        print("To install Ollama on macOS:")
-        print("1. Download Ollama from https://ollama.com/download")
-        print("2. Open the downloaded file and follow the installation instructions")
-        print("3. Start Ollama from your Applications folder")
-        print("\nAlternatively, install via Homebrew:")
-        print("   brew install ollama")
-        print("   ollama serve")
-    elif os_name == "linux":
-        print("To install Ollama on Linux:")
-        print("1. Run the following command:")
-        print("   curl -fsSL https://ollama.com/install.sh | sh")
-        print("2. Start the Ollama service:")
-        print("   ollama serve")
-    elif os_name == "windows":
-        print("To install Ollama on Windows:")
-        print("1. Download Ollama from https://ollama.com/download")
-        print("2. Run the installer and follow the installation instructions")
-        print("3. Start Ollama from the Start menu")
-    else:
-        print(
-            f"Please visit https://ollama.com/download for instructions on installing Ollama on {os_name}"
-        )
+    os_name = platform.system().lower()
+    instructions = INSTALL_INSTRUCTIONS.get(
+        os_name,
+        f"Please visit https://ollama.com/download for instructions on installing Ollama on {os_name}",
+    )
 
+    # Print the whole guide in one call
     print(
-        "\nAfter installation, make sure the Ollama service is running before trying again."
+        "\n=== Ollama Installation Guide ===\n"
+        f"{instructions}\n"
+        "\nAfter installation, make sure the Ollama service is running before trying again.\n"
+        "===================================\n"
     )
-    print("===================================\n")
 
 
 def provide_model_pull_guide(model_name):
@@ -62,28 +100,79 @@ def strip_think_tag(text: str) -> str:
 
     Needed for DeepSeek models which return text with <think> tags.
     """
-    # First attempt to remove complete think tags with content between them
-    # Use non-greedy matching to handle multiple think tags in the same text
-    cleaned_content = re.sub(r"<think>[\s\S]*?</think>", "", text, flags=re.DOTALL)
-
-    # Then handle any orphaned opening tags (in case the closing tag is missing)
-    cleaned_content = re.sub(
-        r"<think>[\s\S]*?($|(?=<think>))", "", cleaned_content, flags=re.DOTALL
-    )
+    cleaned_content = text
+
+    # Most models never emit think tags, so only scan for them when an opening tag is present
+    if "<think>" in cleaned_content:
+        # First remove complete think blocks in a single forward pass. A block runs from
+        # <think> to the first </think> after it, even if another <think> comes first
+        kept_parts = []
+        position = 0
+        while True:
+            start = text.find("<think>", position)
+            if start == -1:
+                break
+            end = text.find("</think>", start + len("<think>"))
+            if end == -1:
+                break
+            kept_parts.append(text[position:start])
+            position = end + len("</think>")
+        kept_parts.append(text[position:])
+        cleaned_content = "".join(kept_parts)
+
+        # Then drop everything from the first orphaned opening tag (one with no closing
+        # tag) to the end. This includes a tag formed by joining the text on either
+        # side of a removed block, e.g. "<thi" + "nk>"
+        orphan_start = cleaned_content.find("<think>")
+        if orphan_start != -1:
+            cleaned_content = cleaned_content[:orphan_start]
 
     # Remove any standalone closing tags that might remain
-    cleaned_content = re.sub(r"</think>", "", cleaned_content)
+    if "</think>" in cleaned_content:
+        cleaned_content = cleaned_content.replace("</think>", "")
 
     # Clean up any extra whitespace or newlines that might have been left behind
-    cleaned_content = re.sub(r"\n{3,}", "\n\n", cleaned_content)
+    if "\n\n\n" in cleaned_content:
+        cleaned_content = EXTRA_NEWLINES_PATTERN.sub("\n\n", cleaned_content)
 
     return cleaned_content.strip()
 
 
+def get_model_names(
+    base_url: str = "http://localhost:11434/api",
+    session: requests.Session = None,
+    timeout=(2.0, 5.0),
+):
+    """
+    Get the names of the locally available models from Ollama.
+    A response younger than TAGS_CACHE_TTL seconds is reused, so constructing several
+    clients (including the summarizer clients) only asks Ollama once.
+
+    :param base_url: The base URL for the Ollama API
+    :param session: Optional session to reuse, the shared module session otherwise
+    :param timeout: Request timeout in seconds, a single value or a (connect, read) tuple
+    :return: A frozenset of model names, for constant time membership checks
+    :raises requests.RequestException: If Ollama could not be reached
+    """
+    cached = _tags_cache.get(base_url)
+    if cached and time.monotonic() - cached[0] < TAGS_CACHE_TTL:
+        return cached[1]
+
+    response = (session or _get_session()).get(f"{base_url}/tags", timeout=timeout)
+    response.raise_for_status()
+    model_names = frozenset(
+        model["name"] for model in response.json().get("models", [])
+    )
+    _tags_cache[base_url] = (time.monotonic(), model_names)
+    return model_names
+
+
 def check_model_availability(
     model_name: str,
     base_url: str = "http://localhost:11434/api",
     quiet_mode: bool = False,
+    session: requests.Session = None,
+    timeout=(2.0, 5.0),
 ):
     """
     Check if the requested model is available.
@@ -92,21 +181,16 @@ def check_model_availability(
     :param model_name: The name of the model to check
     :param base_url: The base URL for the Ollama API
     :param quiet_mode: Whether to suppress success messages
+    :param session: Optional session to reuse, the shared module session otherwise
+    :param timeout: Request timeout in seconds, a single value or a (connect, read) tuple
     :raises RuntimeError: If the model is not available or there's a connection error
     """
     try:
-        response = requests.get(f"{base_url}/tags")
-        models_data = response.json()
-
-        # Check if the model exists in the list of available models
-        model_exists = any(
-            model["name"] == model_name for model in models_data.get("models", [])
-        )
-
-        if model_exists:
+        # Check if the model exists in the set of available models
+        if model_name in get_model_names(base_url, session, timeout):
             if not quiet_mode:
                 console.print(
-                    f"[bold green]Model '{model_name}' is available locally.[/bold green]"
+                    f"[bold green]Model '{escape(model_name)}' is available locally.[/bold green]"
                 )
         else:
             console.print(
@@ -126,13 +210,20 @@ def check_model_availability(
         )
 
 
-def try_start_ollama_service(base_url: str = "http://localhost:11434/api"):
+def try_start_ollama_service(
+    base_url: str = "http://localhost:11434/api", session: requests.Session = None
+):
     """
     Attempt to start the Ollama service if it's installed but not running.
 
     :param base_url: The base URL for the Ollama API
+    :param session: Optional session to reuse, the shared module session otherwise
     :return: True if successfully started, False otherwise
     """
+    import platform
+    import shutil
+    import subprocess
+
     os_name = platform.system().lower()
 
     try:
@@ -142,27 +233,24 @@ def try_start_ollama_service(base_url: str = "http://localhost:11434/api"):
             )
 
             # Check if ollama command is available
-            try:
-                subprocess.run(
-                    ["which", "ollama"],
-                    check=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                )
-
-                # Try to start the service in the background
-                subprocess.Popen(
-                    ["ollama", "serve"],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                )
+            if shutil.which("ollama") is None:
+                return False
 
-                # Wait a moment for the service to start
-                time.sleep(3)
+            # Try to start the service in the background
+            subprocess.Popen(
+                ["ollama", "serve"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
 
-                # Check if the service is now running
+            # Poll until the service responds. Startup usually takes well under a second,
+            # but allow up to 5 seconds for slower machines
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
                 try:
-                    response = requests.get(f"{base_url}/models", timeout=2)
+                    response = (session or _get_session()).get(
+                        f"{base_url}/tags", timeout=0.5
+                    )
                     if response.status_code == 200:
                         console.print(
                             "[bold green]✅ Successfully started Ollama service![/bold green]"
@@ -170,10 +258,7 @@ def try_start_ollama_service(base_url: str = "http://localhost:11434/api"):
                         return True
                 except requests.RequestException:
                     pass
-
-            except subprocess.CalledProcessError:
-                # ollama command not found
-                return False
+                time.sleep(0.1)
 
         # For Windows or if the above failed
         return False
@@ -186,7 +271,9 @@ def try_start_ollama_service(base_url: str = "http://localhost:11434/api"):
 
 
 def check_ollama_availability(
-    base_url: str = "http://localhost:11434/api", quiet_mode: bool = False
+    base_url: str = "http://localhost:11434/api",
+    quiet_mode: bool = False,
+    session: requests.Session = None,
 ):
     """
     Check if Ollama is installed and running.
@@ -194,17 +281,17 @@ def check_ollama_availability(
 
     :param base_url: The base URL for the Ollama API
     :param quiet_mode: Whether to suppress success messages
+    :param session: Optional session to reuse, the shared module session otherwise
     :raises RuntimeError: If Ollama server is not available
     """
     try:
-        response = requests.get(f"{base_url}/tags", timeout=5)
-        response.raise_for_status()
+        get_model_names(base_url, session, timeout=5)
     except requests.RequestException as e:
         console.print(
             "[bold red]Ollama server is not available. Please install Ollama first.[/bold red]"
         )
         provide_ollama_installation_guide()
-        try_start_ollama_service(base_url)  # Attempt to start the service
+        try_start_ollama_service(base_url, session)  # Attempt to start the service
         raise RuntimeError(
             "Ollama server is not available. Please follow the installation instructions above."
         )
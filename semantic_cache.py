@@ -0,0 +1,88 @@
+"""
+Semantic cache of model replies, keyed by an embedding of the message being replied to.
+"""
+
+import math
+import requests
+from collections import deque
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        embed_model: str,
+        threshold: float,
+        base_url: str = "http://localhost:11434/api",
+        session: requests.Session = None,
+        debug_mode: bool = False,
+        max_entries: int = 256,
+    ):
+        self.embed_model = embed_model
+        self.threshold = threshold
+        self.base_url = base_url
+        self.session = session or requests.Session()
+        self.debug_mode = debug_mode
+        # (normalized embedding, reply) tuples, least recently used first.
+        # Once full, storing a new entry drops the least recently used one
+        self.entries = deque(maxlen=max_entries)
+
+    def embed(self, text: str):
+        """
+        Get a normalized embedding for the text from Ollama.
+
+        :param text: The text to embed.
+        :return: The embedding as a list of floats with unit length, or None on error.
+        """
+        try:
+            response = self.session.post(
+                f"{self.base_url}/embed",
+                json={"model": self.embed_model, "input": text},
+            )
+            response.raise_for_status()
+            embedding = response.json()["embeddings"][0]
+        except (requests.RequestException, KeyError, IndexError) as e:
+            if self.debug_mode:
+                print(f"Error getting embedding from {self.embed_model}: {e}")
+            return None
+
+        norm = math.sqrt(sum(x * x for x in embedding))
+        if not norm:
+            return None
+        return [x / norm for x in embedding]
+
+    def lookup(self, embedding):
+        """
+        Find the cached reply whose message is most similar to the embedding.
+
+        :param embedding: A normalized embedding from embed().
+        :return: The cached reply if its similarity reaches the threshold, otherwise None.
+        """
+        best_index = None
+        best_similarity = self.threshold
+        for index, (cached_embedding, _) in enumerate(self.entries):
+            # Both embeddings are normalized, so the dot product is the cosine similarity
+            similarity = sum(a * b for a, b in zip(embedding, cached_embedding))
+            if similarity >= best_similarity:
+                best_similarity = similarity
+                best_index = index
+
+        if best_index is None:
+            return None
+
+        # Mark the entry as the most recently used
+        entry = self.entries[best_index]
+        del self.entries[best_index]
+        self.entries.append(entry)
+
+        if self.debug_mode:
+            print(f"Semantic cache hit with similarity {best_similarity:.3f}")
+        return entry[1]
+
+    def store(self, embedding, reply: str):
+        """
+        Cache a reply for the message with the given embedding.
+
+        :param embedding: A normalized embedding from embed().
+        :param reply: The reply to cache.
+        """
+        self.entries.append((embedding, reply))